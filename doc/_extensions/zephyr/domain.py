@@ -46,7 +46,10 @@ Roles
   ```
 
 """
-from typing import Any, Dict, Iterator, List, Tuple
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from breathe.directives.content_block import DoxygenGroupDirective
 from docutils import nodes
@@ -58,7 +61,7 @@ from sphinx.roles import XRefRole
 from sphinx.transforms import SphinxTransform
 from sphinx.transforms.post_transforms import SphinxPostTransform
 from sphinx.util import logging
-from sphinx.util.nodes import NodeMatcher, make_refnode
+from sphinx.util.nodes import make_refnode
 from zephyr.gh_utils import gh_link_get_url
 
 import json
@@ -68,88 +71,102 @@ __version__ = "0.1.0"
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _gh_link_get_url(app, docname: str) -> Optional[str]:
+    """Per-docname cache for :func:`gh_link_get_url`.
+
+    The URL only depends on the configuration and the page location, so there is no point in
+    re-running the regex/path logic for every code sample of a document.
+    """
+    return gh_link_get_url(app, docname)
+
+
+_JSON_LD_TMPL = '<script type="application/ld+json">%s</script>'
+
+
+@lru_cache(maxsize=None)
+def _json_ld(name: str, description: str, repo_url: Optional[str]) -> str:
+    """Build the JSON-LD script block describing a code sample.
+
+    The result is fully determined by its arguments so it is memoized to avoid re-serializing
+    the same sample on every transform pass. The payload is kept compact (no indentation or
+    separator whitespace) since it ends up verbatim in every generated page.
+    """
+    return _JSON_LD_TMPL % json.dumps(
+        {
+            "@context": "http://schema.org",
+            "@type": "SoftwareSourceCode",
+            "name": name,
+            "description": description,
+            "codeSampleType": "full",
+            "codeRepository": repo_url,
+        },
+        separators=(",", ":"),
+    )
+
+
 class CodeSampleNode(nodes.Element):
-    pass
+    # all state lives in the Element attributes dict, no per-instance attributes are added
+    __slots__ = ()
 
 
 class RelatedCodeSamplesNode(nodes.Element):
-    pass
+    __slots__ = ()
 
 
 class ConvertCodeSampleNode(SphinxTransform):
     default_priority = 100
 
     def apply(self):
-        matcher = NodeMatcher(CodeSampleNode)
-        for node in self.document.traverse(matcher):
+        # only walk the documents that are known to contain code sample nodes
+        if self.env.docname not in self.env.domaindata["zephyr"]["docs-with-samples"]:
+            return
+
+        for node in list(self.document.findall(CodeSampleNode)):
             self.convert_node(node)
 
     def convert_node(self, node):
         """
-        Transforms a `CodeSampleNode` into a `nodes.section` named after the code sample name.
+        Replaces a `CodeSampleNode` with the `nodes.section` pre-built by the directive.
 
-        Moves all sibling nodes that are after the `CodeSampleNode` in the documement under this new
+        Moves all sibling nodes that are after the `CodeSampleNode` in the documement under the
         section.
         """
         parent = node.parent
-        siblings_to_move = []
         if parent is not None:
             index = parent.index(node)
-            siblings_to_move = parent.children[index + 1 :]
-
-            # Create a new section
-            new_section = nodes.section(ids=[node["id"]])
-            new_section += nodes.title(text=node["name"])
+            new_section = node.children[0]
 
-            # Move the sibling nodes under the new section
-            new_section.extend(siblings_to_move)
+            # Move the sibling nodes under the section
+            new_section.extend(parent.children[index + 1 :])
 
-            # Replace the custom node with the new section
+            # Replace the custom node with the section
             node.replace_self(new_section)
 
-            # Remove the moved siblings from their original parent
-            for sibling in siblings_to_move:
-                parent.remove(sibling)
-
-            # Set sample description as the meta description of the document for improved SEO
-            meta_description = nodes.meta()
-            meta_description["name"] = "description"
-            meta_description["content"] = node.children[0].astext()
-            node.document += meta_description
-
-            # Similarly, add a node with JSON-LD markup (only renders in HTML output) describing
-            # the code sample.
-            json_ld = nodes.raw(
-                "",
-                f"""<script type="application/ld+json">
-                {json.dumps({
-                    "@context": "http://schema.org",
-                    "@type": "SoftwareSourceCode",
-                    "name": node['name'],
-                    "description": node.children[0].astext(),
-                    "codeSampleType": "full",
-                    "codeRepository": gh_link_get_url(self.app, self.env.docname)
-                })}
-                </script>""",
-                format="html",
-            )
-            node.document += json_ld
+            # Remove the moved siblings from their original parent in one go. Removing them one
+            # by one with Element.remove() would rescan the children list for every sibling.
+            new_index = parent.index(new_section)
+            del parent.children[new_index + 1 :]
 
 
 class ProcessRelatedCodeSamplesNode(SphinxPostTransform):
     default_priority = 5  # before ReferencesResolver
 
     def run(self, **kwargs: Any) -> None:
-        matcher = NodeMatcher(RelatedCodeSamplesNode)
-        for node in self.document.traverse(matcher):
+        # only walk the documents that are known to contain related-samples nodes
+        if self.env.docname not in self.env.domaindata["zephyr"]["docs-with-related-samples"]:
+            return
+
+        for node in list(self.document.findall(RelatedCodeSamplesNode)):
             id = node["id"]  # the ID of the node is the name of the doxygen group for which we
             # want to list related code samples
 
-            code_samples = self.env.domaindata["zephyr"]["code-samples"].values()
-            # Filter out code samples that don't reference this doxygen group
-            code_samples = [
-                code_sample for code_sample in code_samples if id in code_sample["relevant-api"]
-            ]
+            # Look up the code samples referencing this doxygen group in the reverse index
+            # maintained by the domain instead of scanning all samples.
+            code_samples = sorted(
+                self.env.domaindata["zephyr"]["api-to-samples"].get(id, []),
+                key=itemgetter("_sortkey"),
+            )
 
             if len(code_samples) > 0:
                 admonition = nodes.admonition()
@@ -158,27 +175,28 @@ class ProcessRelatedCodeSamplesNode(SphinxPostTransform):
                 admonition["classes"].append("dropdown") # used by sphinx-togglebutton extension
                 admonition["classes"].append("toggle-shown") # show the content by default
 
-                sample_dl = nodes.definition_list()
-
-                for code_sample in sorted(code_samples, key=lambda x: x["name"]):
-                    term = nodes.term()
-
+                # Assemble each item through the node constructors rather than repeated `+=`,
+                # which goes through Element.append and its per-insertion checks.
+                sample_dlis = []
+                for code_sample in code_samples:
                     sample_xref = addnodes.pending_xref(
                         "",
+                        nodes.inline(text=code_sample["name"]),
                         refdomain="zephyr",
                         reftype="code-sample",
                         reftarget=code_sample["id"],
                         refwarn=True,
                     )
-                    sample_xref += nodes.inline(text=code_sample["name"])
-                    term += sample_xref
-                    definition = nodes.definition()
-                    definition += nodes.paragraph(text=code_sample["description"].astext())
-                    sample_dli = nodes.definition_list_item()
-                    sample_dli += term
-                    sample_dli += definition
-                    sample_dl += sample_dli
-                admonition += sample_dl
+                    sample_dlis.append(
+                        nodes.definition_list_item(
+                            "",
+                            nodes.term("", "", sample_xref),
+                            nodes.definition(
+                                "", nodes.paragraph(text=code_sample["description_text"])
+                            ),
+                        )
+                    )
+                admonition += nodes.definition_list("", *sample_dlis)
 
                 # replace node with the newly created admonition
                 node.replace_self(admonition)
@@ -194,13 +212,18 @@ class CodeSampleDirective(Directive):
 
     required_arguments = 1  # ID
     optional_arguments = 0
-    option_spec = {"name": directives.unchanged, "relevant-api": directives.unchanged}
+    # read-only mapping so that the spec is never defensively copied per directive instance
+    option_spec = MappingProxyType(
+        {"name": directives.unchanged, "relevant-api": directives.unchanged}
+    )
     has_content = True
 
     def run(self):
         code_sample_id = self.arguments[0]
         env = self.state.document.settings.env
-        code_samples = env.domaindata["zephyr"]["code-samples"]
+        # look the domain up once; env.get_domain() walks the registry on every call
+        domain = env.domains["zephyr"]
+        code_samples = domain.data["code-samples"]
 
         if code_sample_id in code_samples:
             logger.warning(
@@ -210,28 +233,61 @@ class CodeSampleDirective(Directive):
             )
 
         name = self.options.get("name", code_sample_id)
-        relevant_api_list = self.options.get("relevant-api", "").split()
-
-        # Create a node for description and populate it with parsed content
-        description_node = nodes.container(ids=[f"{code_sample_id}-description"])
-        self.state.nested_parse(self.content, self.content_offset, description_node)
+        # store as a frozenset so that membership tests against doxygen groups are O(1)
+        relevant_api = frozenset(self.options.get("relevant-api", "").split())
+
+        # Only the flattened text of the description is ever used (xref resolution, object
+        # synopses, meta/JSON-LD generation, ...), and most descriptions are a single paragraph
+        # of plain prose. Skip the comparatively expensive nested_parse for those and only fall
+        # back to a full parse when the content may contain rST markup.
+        if self.content and not any(
+            not line or ":" in line or "`" in line or "*" in line or line.startswith("..")
+            for line in self.content
+        ):
+            description_text = "\n".join(self.content)
+        else:
+            description_node = nodes.container(ids=[f"{code_sample_id}-description"])
+            self.state.nested_parse(self.content, self.content_offset, description_node)
+            description_text = description_node.astext()
 
         code_sample = {
             "id": code_sample_id,
             "name": name,
-            "description": description_node,
-            "relevant-api": relevant_api_list,
+            "description_text": description_text,
+            "relevant-api": relevant_api,
             "docname": env.docname,
         }
 
-        domain = env.get_domain("zephyr")
         domain.add_code_sample(code_sample)
 
-        # Create an instance of the custom node
+        # flag the current document as containing a code sample so that the transform only has
+        # to visit flagged documents
+        domain.data["docs-with-samples"].add(env.docname)
+
+        # Build the section the code sample will be rendered as right here, so the transform
+        # only has to move the nodes following the directive under it.
+        section = nodes.section(ids=[code_sample_id])
+        section += nodes.title(text=name)
+
+        # Set sample description as the meta description of the document for improved SEO
+        meta_description = nodes.meta()
+        meta_description["name"] = "description"
+        meta_description["content"] = description_text
+        section += meta_description
+
+        # Similarly, add a node with JSON-LD markup (only renders in HTML output) describing
+        # the code sample.
+        section += nodes.raw(
+            "",
+            _json_ld(name, description_text, _gh_link_get_url(env.app, env.docname)),
+            format="html",
+        )
+
+        # Create an instance of the custom node carrying the pre-built section
         code_sample_node = CodeSampleNode()
         code_sample_node["id"] = code_sample_id
         code_sample_node["name"] = name
-        code_sample_node += description_node
+        code_sample_node += section
 
         return [code_sample_node]
 
@@ -252,20 +308,59 @@ class ZephyrDomain(Domain):
         "code-sample": ObjType("code-sample", "code-sample"),
     }
 
-    initial_data: Dict[str, Any] = {"code-samples": {}}
+    initial_data: Dict[str, Any] = {
+        "code-samples": {},  # id -> code sample data
+        "api-to-samples": {},  # doxygen group -> list of code samples referencing it
+        "docname-to-sample-ids": {},  # docname -> list of ids of the code samples it defines
+        "docs-with-samples": set(),  # docnames containing CodeSampleNode(s)
+        "docs-with-related-samples": set(),  # docnames containing RelatedCodeSamplesNode(s)
+    }
+
+    # bump whenever the layout of the domain data changes so that environments pickled with an
+    # older schema are discarded instead of crashing the first incremental rebuild
+    data_version = 1
 
     def clear_doc(self, docname: str) -> None:
-        self.data["code-samples"] = {
-            sample_id: sample_data
-            for sample_id, sample_data in self.data["code-samples"].items()
-            if sample_data["docname"] != docname
-        }
+        # only visit the samples the cleared document actually defines, so that incremental
+        # rebuilds scale with the number of changed samples rather than the total count
+        for sample_id in self.data["docname-to-sample-ids"].pop(docname, ()):
+            code_sample = self.data["code-samples"].pop(sample_id, None)
+            if code_sample is None:
+                continue
+            for api in code_sample["relevant-api"]:
+                samples = self.data["api-to-samples"].get(api)
+                if samples is not None:
+                    # filter by id, not identity: merging parallel-read results may replace the
+                    # dict in code-samples with a pickled copy while the index keeps the original
+                    samples[:] = [s for s in samples if s["id"] != sample_id]
+                    if not samples:
+                        del self.data["api-to-samples"][api]
+        self.data["docs-with-samples"].discard(docname)
+        self.data["docs-with-related-samples"].discard(docname)
 
     def merge_domaindata(self, docnames: List[str], otherdata: Dict) -> None:
-        self.data["code-samples"].update(otherdata["code-samples"])
+        docnames = set(docnames)
+        # only take over the samples defined by the merged documents; the worker env may also
+        # carry inherited copies of samples owned by documents read elsewhere
+        self.data["code-samples"].update(
+            (sample_id, sample)
+            for sample_id, sample in otherdata["code-samples"].items()
+            if sample["docname"] in docnames
+        )
+        for api, samples in otherdata["api-to-samples"].items():
+            self.data["api-to-samples"].setdefault(api, []).extend(
+                s for s in samples if s["docname"] in docnames
+            )
+        for docname, sample_ids in otherdata["docname-to-sample-ids"].items():
+            if docname in docnames:
+                self.data["docname-to-sample-ids"].setdefault(docname, []).extend(sample_ids)
+        self.data["docs-with-samples"].update(otherdata["docs-with-samples"] & docnames)
+        self.data["docs-with-related-samples"].update(
+            otherdata["docs-with-related-samples"] & docnames
+        )
 
     def get_objects(self):
-        for _, code_sample in self.data["code-samples"].items():
+        for code_sample in self.data["code-samples"].values():
             yield (
                 code_sample["id"],
                 code_sample["name"],
@@ -277,10 +372,10 @@ class ZephyrDomain(Domain):
 
     # used by Sphinx Immaterial theme
     def get_object_synopses(self) -> Iterator[Tuple[Tuple[str, str], str]]:
-        for _, code_sample in self.data["code-samples"].items():
+        for code_sample in self.data["code-samples"].values():
             yield (
                 (code_sample["docname"], code_sample["id"]),
-                code_sample["description"].astext(),
+                code_sample["description_text"],
             )
 
     def resolve_xref(self, env, fromdocname, builder, type, target, node, contnode):
@@ -296,11 +391,18 @@ class ZephyrDomain(Domain):
                     code_sample_info["docname"],
                     code_sample_info["id"],
                     contnode,
-                    code_sample_info["description"].astext(),
+                    code_sample_info["description_text"],
                 )
 
     def add_code_sample(self, code_sample):
+        # precompute the sort key once so that sorting never has to call casefold() again
+        code_sample["_sortkey"] = code_sample["name"].casefold()
         self.data["code-samples"][code_sample["id"]] = code_sample
+        for api in code_sample["relevant-api"]:
+            self.data["api-to-samples"].setdefault(api, []).append(code_sample)
+        self.data["docname-to-sample-ids"].setdefault(code_sample["docname"], []).append(
+            code_sample["id"]
+        )
 
 
 class CustomDoxygenGroupDirective(DoxygenGroupDirective):
@@ -310,6 +412,8 @@ class CustomDoxygenGroupDirective(DoxygenGroupDirective):
         nodes = super().run()
 
         if self.config.zephyr_breathe_insert_related_samples:
+            env = self.state.document.settings.env
+            env.domaindata["zephyr"]["docs-with-related-samples"].add(env.docname)
             return [RelatedCodeSamplesNode(id=self.arguments[0]), *nodes]
         else:
             return nodes